@@ -1,28 +1,75 @@
-import requests
-from bs4 import BeautifulSoup
+import time
+_START_TIME = time.perf_counter()
+
 import re
-from PIL import Image, ImageOps, ImageEnhance
-import pytesseract
 from io import BytesIO
 import os
 import threading
+import hashlib
 import json
 import sqlite3
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dotenv import load_dotenv
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import platform
 import sys
 import argparse
 
+# Ciężkie zależności (requests, bs4, PIL, pytesseract, dotenv) są importowane
+# dopiero w funkcjach, które ich potrzebują — dzięki temu pierwszy emit()
+# trafia do GUI zanim binarka PyInstallera załaduje całą resztę.
+
 # --- KONFIGURACJA ---
-load_dotenv() 
+
+def resolve_data_paths():
+    """(Re)compute data paths — called again by load_env() once .env is loaded."""
+    global DATA_DIR, SAVE_FOLDER, OCR_CACHE_DB, TESSERACT_PROBE_CACHE
+    # Use BIEDRONA_DATA_DIR if set (packaged Electron), otherwise script directory
+    DATA_DIR = os.environ.get('BIEDRONA_DATA_DIR', os.path.dirname(os.path.abspath(__file__)))
+    SAVE_FOLDER = os.path.join(DATA_DIR, "gazetki")
+    OCR_CACHE_DB = os.path.join(DATA_DIR, "ocr_cache.db")
+    TESSERACT_PROBE_CACHE = os.path.join(DATA_DIR, "tesseract_probe.json")
+
+resolve_data_paths()
+
+def load_tesseract_probe(tess_cmd):
+    """Return cached `tesseract --version` line if the binary path and mtime still match."""
+    try:
+        mtime = os.path.getmtime(tess_cmd)
+        with open(TESSERACT_PROBE_CACHE, encoding="utf-8") as f:
+            probe = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(probe, dict)
+        or probe.get("cmd") != tess_cmd
+        or probe.get("mtime") != mtime
+        or probe.get("tessdata_prefix") != os.environ.get("TESSDATA_PREFIX")
+    ):
+        return None
+    return probe.get("version")
+
+def save_tesseract_probe(tess_cmd, version):
+    try:
+        probe = {
+            "cmd": tess_cmd,
+            "mtime": os.path.getmtime(tess_cmd),
+            "tessdata_prefix": os.environ.get("TESSDATA_PREFIX"),
+            "version": version,
+        }
+        with open(TESSERACT_PROBE_CACHE, "w", encoding="utf-8") as f:
+            json.dump(probe, f)
+    except OSError as e:
+        print(f"[Tesseract] Nie udało się zapisać cache sondy: {e}", file=sys.stderr)
 
 def get_tesseract_cmd():
     """Detect Tesseract: bundled (env var) > system default."""
     # 1. Check env var set by Electron in packaged mode
     env_cmd = os.environ.get('TESSERACT_CMD')
     if env_cmd and os.path.isfile(env_cmd):
+        if load_tesseract_probe(env_cmd) is not None:
+            # Already verified in a previous run — skip tessdata listing and chmod
+            print(f"[Tesseract] Using bundled (cached probe): {env_cmd}", file=sys.stderr)
+            return env_cmd
         tessdata_prefix = os.environ.get('TESSDATA_PREFIX')
         if tessdata_prefix:
             # Ensure TESSDATA_PREFIX points to the parent containing tessdata/
@@ -51,17 +98,52 @@ def get_tesseract_cmd():
         print(f"[Tesseract] TESSERACT_CMD was set to '{env_cmd}' but file not found!", file=sys.stderr)
     return fallback
 
-pytesseract.pytesseract.tesseract_cmd = get_tesseract_cmd()
-
-# Use BIEDRONA_DATA_DIR if set (packaged Electron), otherwise script directory
-DATA_DIR = os.environ.get('BIEDRONA_DATA_DIR', os.path.dirname(os.path.abspath(__file__)))
+_tesseract_cmd = None
+_tesseract_lock = threading.Lock()
+
+def setup_tesseract():
+    """Import pytesseract and point it at the detected binary (once per process)."""
+    global _tesseract_cmd
+    with _tesseract_lock:
+        if _tesseract_cmd is None:
+            import pytesseract
+            _tesseract_cmd = get_tesseract_cmd()
+            pytesseract.pytesseract.tesseract_cmd = _tesseract_cmd
+        return _tesseract_cmd
+
+def probe_tesseract(tess_cmd):
+    """Return (version line, from_cache). Runs `tesseract --version` only when the binary changed."""
+    version = load_tesseract_probe(tess_cmd)
+    if version is not None:
+        return version, True
+    import subprocess
+    result = subprocess.run(
+        [tess_cmd, "--version"],
+        capture_output=True, text=True, timeout=10
+    )
+    version = (result.stdout + result.stderr).strip().split('\n')[0]
+    # Cache'ujemy tylko poprawną odpowiedź — błąd (np. brak bibliotek) nie może utknąć w cache
+    if result.returncode != 0 or not version.lower().startswith("tesseract"):
+        raise RuntimeError(f"kod {result.returncode}: {version or '(brak wyjścia)'}")
+    save_tesseract_probe(tess_cmd, version)
+    return version, False
 
 KEYWORD_TO_FIND = "" # Zostanie ustawione przez użytkownika
-SAVE_FOLDER = os.path.join(DATA_DIR, "gazetki")
 MAX_WORKERS = 5 # Utrzymujemy 5 wątków (każdy robi teraz 2x więcej pracy, więc nie zwiększamy)
-OCR_CACHE_DB = os.path.join(DATA_DIR, "ocr_cache.db")
-
-DISCORD_URL = os.getenv("DISCORD_WEBHOOK_URL")
+# Strony z nieaktywnych gazetek zostają w cache (po hashu treści), żeby ponownie
+# opublikowane strony nie były OCR-owane od nowa.
+# Nadpisywane przez load_env() z BIEDRONA_CACHE_RETENTION_DAYS / BIEDRONA_CACHE_MAX_MB
+CACHE_RETENTION_DAYS = 28
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Tryb ograniczonej pamięci: wspólny budżet bajtów dla wszystkich wątków OCR (0 = bez limitu).
+# Nadpisywane przez load_env() z BIEDRONA_MEMORY_BUDGET_MB
+MEMORY_BUDGET_BYTES = 0
+# Szacunkowy narzut na piksel dla wariantów roboczych (najgorszy przypadek: skan 'snajper')
+OCR_PIXEL_OVERHEAD = 12
+# Rezerwacja na pobranie strony (korygowana do faktycznego rozmiaru po pobraniu)
+DOWNLOAD_ESTIMATE_BYTES = 2 * 1024 * 1024
+
+DISCORD_URL = None # Ustawiane przez load_env()
 MAX_DISCORD_SIZE_BYTES = 7.5 * 1024 * 1024 
 MAX_DISCORD_FILES_COUNT = 10
 MAX_DISCORD_EMBEDS_COUNT = 10
@@ -71,9 +153,106 @@ HEADERS = {
 }
 
 print_lock = threading.Lock()
+memory_cond = threading.Condition()
+memory_in_use = 0
+memory_waiting_held = 0
 
 # --------------------
 
+def env_number(name, default):
+    """Read a numeric setting from the environment, falling back to `default` on a bad value."""
+    raw = os.environ.get(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        print(f"[CONFIG] Nieprawidłowa wartość {name}={raw!r}, używam {default}", file=sys.stderr)
+        return default
+
+def load_env():
+    global DISCORD_URL, CACHE_RETENTION_DAYS, CACHE_MAX_BYTES, MEMORY_BUDGET_BYTES
+    from dotenv import load_dotenv
+    load_dotenv()
+    resolve_data_paths()
+    DISCORD_URL = os.getenv("DISCORD_WEBHOOK_URL")
+    CACHE_RETENTION_DAYS = env_number("BIEDRONA_CACHE_RETENTION_DAYS", 28)
+    CACHE_MAX_BYTES = int(env_number("BIEDRONA_CACHE_MAX_MB", 64) * 1024 * 1024)
+    MEMORY_BUDGET_BYTES = int(max(0, env_number("BIEDRONA_MEMORY_BUDGET_MB", 0)) * 1024 * 1024)
+
+def reserve_memory(nbytes, held=0):
+    """
+    Block until `nbytes` fits in MEMORY_BUDGET_BYTES. Returns the amount reserved.
+    `held` is what the caller has already reserved (e.g. the downloaded bytes);
+    when every reservation belongs to such waiting callers, one is let through
+    so they cannot deadlock each other.
+    """
+    global memory_in_use, memory_waiting_held
+    if not MEMORY_BUDGET_BYTES:
+        return 0
+    with memory_cond:
+        memory_waiting_held += held
+        memory_cond.notify_all()
+        try:
+            # Strona większa niż cały budżet przechodzi, gdy nic innego nie jest w toku
+            while memory_in_use and memory_in_use + nbytes > MEMORY_BUDGET_BYTES:
+                if held and memory_in_use <= memory_waiting_held:
+                    break
+                memory_cond.wait()
+        finally:
+            memory_waiting_held -= held
+        memory_in_use += nbytes
+    return nbytes
+
+def release_memory(nbytes):
+    global memory_in_use
+    if not nbytes:
+        return
+    with memory_cond:
+        memory_in_use -= nbytes
+        memory_cond.notify_all()
+
+def get_peak_rss_mb():
+    if platform.system() == "Windows":
+        return get_peak_working_set_mb()
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024 # macOS podaje bajty, Linux kilobajty
+    return round(peak / 1024, 1)
+
+def get_peak_working_set_mb():
+    """Windows counterpart of ru_maxrss: PeakWorkingSetSize from GetProcessMemoryInfo."""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    # K32GetProcessMemoryInfo jest w kernel32 od Windows 7 (bez zależności od psapi.dll)
+    get_info = kernel32.K32GetProcessMemoryInfo
+    get_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+    get_info.restype = wintypes.BOOL
+    if not get_info(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        print(f"[DIAG] GetProcessMemoryInfo nie powiodło się: {ctypes.get_last_error()}", file=sys.stderr)
+        return None
+    return round(counters.PeakWorkingSetSize / (1024 * 1024), 1)
+
 def chunked(items, size=900):
     for i in range(0, len(items), size):
         yield items[i:i + size]
@@ -90,11 +269,20 @@ def init_cache_db():
             leaflet_name TEXT,
             page_number INTEGER,
             ocr_text TEXT,
-            indexed_at TEXT
+            indexed_at TEXT,
+            content_hash TEXT,
+            last_used_at TEXT
         )
         """
     )
+    # Migracja starszych baz bez kolumn retencji
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(pages)")}
+    if "content_hash" not in columns:
+        conn.execute("ALTER TABLE pages ADD COLUMN content_hash TEXT")
+    if "last_used_at" not in columns:
+        conn.execute("ALTER TABLE pages ADD COLUMN last_used_at TEXT")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_leaflet_id ON pages(leaflet_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_content_hash ON pages(content_hash)")
     conn.execute(
         """
         CREATE VIRTUAL TABLE IF NOT EXISTS ocr_fts
@@ -147,49 +335,130 @@ def get_cached_hits(conn, tasks, keyword):
 
     return hits
 
-def prune_cache_for_active_leaflets(conn, active_leaflet_ids):
-    if not active_leaflet_ids:
-        removed_pages = conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
-        conn.execute("DELETE FROM pages")
-        conn.execute("DELETE FROM ocr_fts")
-        return removed_pages
+def delete_cached_urls(conn, urls):
+    for urls_chunk in chunked(urls):
+        placeholders = ",".join(["?"] * len(urls_chunk))
+        conn.execute(f"DELETE FROM pages WHERE image_url IN ({placeholders})", urls_chunk)
+        conn.execute(f"DELETE FROM ocr_fts WHERE image_url IN ({placeholders})", urls_chunk)
+
+def touch_cached_pages(conn, tasks):
+    """
+    Oznacza strony obsłużone z cache jako użyte i przepisuje je do bieżącej
+    gazetki — ten sam URL mógł trafić do nowej gazetki, a wpis ma starą.
+    """
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    task_by_url = {task["url"]: task for task in tasks}
+    moved = []
+    for urls_chunk in chunked(list(task_by_url.keys())):
+        placeholders = ",".join(["?"] * len(urls_chunk))
+        rows = conn.execute(
+            f"SELECT image_url, leaflet_id, leaflet_name, page_number FROM pages WHERE image_url IN ({placeholders})",
+            urls_chunk,
+        ).fetchall()
+        for image_url, leaflet_id, leaflet_name, page_number in rows:
+            task = task_by_url[image_url]
+            if (leaflet_id, leaflet_name, page_number) != (task["leaflet_id"], task["leaflet_name"], task["page_number"]):
+                moved.append(task)
+
+    conn.executemany(
+        "UPDATE pages SET last_used_at = ? WHERE image_url = ?",
+        [(now, url) for url in task_by_url],
+    )
+    conn.executemany(
+        "UPDATE pages SET leaflet_id = ?, leaflet_name = ?, page_number = ? WHERE image_url = ?",
+        [(task["leaflet_id"], task["leaflet_name"], task["page_number"], task["url"]) for task in moved],
+    )
+    conn.executemany(
+        "UPDATE ocr_fts SET leaflet_name = ?, page_number = ? WHERE image_url = ?",
+        [(task["leaflet_name"], str(task["page_number"]), task["url"]) for task in moved],
+    )
 
+def apply_cache_retention(conn, active_leaflet_ids):
+    """
+    Miękka retencja cache zamiast twardego czyszczenia.
+    Strony aktywnych gazetek są oznaczane jako użyte. Strony nieaktywnych
+    gazetek zostają (po hashu treści) przez CACHE_RETENTION_DAYS od ostatniego
+    użycia, a potem są usuwane od najdawniej używanych, aż tekst OCR w cache
+    (w bajtach UTF-8, liczony podwójnie: tabela pages i kopia w ocr_fts)
+    zmieści się w CACHE_MAX_BYTES. Zwraca liczbę usuniętych stron.
+    """
+    now = datetime.utcnow()
     conn.execute("CREATE TEMP TABLE IF NOT EXISTS active_leaflets(leaflet_id TEXT PRIMARY KEY)")
     conn.execute("DELETE FROM active_leaflets")
     conn.executemany(
         "INSERT OR IGNORE INTO active_leaflets(leaflet_id) VALUES (?)",
         [(leaflet_id,) for leaflet_id in active_leaflet_ids],
     )
+    conn.execute(
+        """
+        UPDATE pages SET last_used_at = ?
+        WHERE leaflet_id IN (SELECT leaflet_id FROM active_leaflets)
+        """,
+        (now.isoformat(timespec="seconds"),),
+    )
 
-    obsolete_rows = conn.execute(
+    # Nieaktywne strony, najdawniej używane najpierw
+    inactive_rows = conn.execute(
         """
-        SELECT p.image_url
+        SELECT p.image_url, p.content_hash, COALESCE(p.last_used_at, p.indexed_at), 2 * LENGTH(CAST(p.ocr_text AS BLOB))
         FROM pages p
         LEFT JOIN active_leaflets a ON p.leaflet_id = a.leaflet_id
         WHERE a.leaflet_id IS NULL
+        ORDER BY COALESCE(p.last_used_at, p.indexed_at) ASC
         """
     ).fetchall()
-    obsolete_urls = [row[0] for row in obsolete_rows]
 
-    for urls_chunk in chunked(obsolete_urls):
-        placeholders = ",".join(["?"] * len(urls_chunk))
-        conn.execute(f"DELETE FROM pages WHERE image_url IN ({placeholders})", urls_chunk)
-        conn.execute(f"DELETE FROM ocr_fts WHERE image_url IN ({placeholders})", urls_chunk)
+    cutoff = (now - timedelta(days=CACHE_RETENTION_DAYS)).isoformat(timespec="seconds")
+    total_bytes = conn.execute("SELECT 2 * COALESCE(SUM(LENGTH(CAST(ocr_text AS BLOB))), 0) FROM pages").fetchone()[0]
+    evicted_urls = []
+    for image_url, content_hash, last_used_at, text_bytes in inactive_rows:
+        # Bez hasha (stare wpisy) strony nie da się odzyskać — nie ma sensu jej trzymać
+        expired = not content_hash or not last_used_at or last_used_at < cutoff
+        if expired or total_bytes > CACHE_MAX_BYTES:
+            evicted_urls.append(image_url)
+            total_bytes -= text_bytes or 0
+
+    delete_cached_urls(conn, evicted_urls)
+    return len(evicted_urls)
+
+def get_known_content_hashes(conn):
+    rows = conn.execute("SELECT DISTINCT content_hash FROM pages WHERE content_hash IS NOT NULL").fetchall()
+    return {row[0] for row in rows}
+
+def get_matching_content_hashes(conn, keyword):
+    """Hashes of cached pages whose OCR text matches `keyword` (so revived hits keep their bytes)."""
+    rows = conn.execute(
+        """
+        SELECT DISTINCT p.content_hash
+        FROM ocr_fts f
+        JOIN pages p ON p.image_url = f.image_url
+        WHERE ocr_fts MATCH ? AND p.content_hash IS NOT NULL
+        """,
+        (build_fts_match_query(keyword),),
+    ).fetchall()
+    return {row[0] for row in rows}
 
-    return len(obsolete_urls)
+def get_text_by_content_hash(conn, content_hash):
+    row = conn.execute(
+        "SELECT ocr_text FROM pages WHERE content_hash = ? ORDER BY last_used_at DESC LIMIT 1",
+        (content_hash,),
+    ).fetchone()
+    return row[0] if row else None
 
-def save_page_to_cache(conn, task_data, ocr_text):
+def save_page_to_cache(conn, task_data, ocr_text, content_hash=None):
     now = datetime.utcnow().isoformat(timespec="seconds")
     conn.execute(
         """
-        INSERT INTO pages (image_url, leaflet_id, leaflet_name, page_number, ocr_text, indexed_at)
-        VALUES (?, ?, ?, ?, ?, ?)
+        INSERT INTO pages (image_url, leaflet_id, leaflet_name, page_number, ocr_text, indexed_at, content_hash, last_used_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ON CONFLICT(image_url) DO UPDATE SET
             leaflet_id=excluded.leaflet_id,
             leaflet_name=excluded.leaflet_name,
             page_number=excluded.page_number,
             ocr_text=excluded.ocr_text,
-            indexed_at=excluded.indexed_at
+            indexed_at=excluded.indexed_at,
+            content_hash=excluded.content_hash,
+            last_used_at=excluded.last_used_at
         """,
         (
             task_data["url"],
@@ -198,6 +467,8 @@ def save_page_to_cache(conn, task_data, ocr_text):
             task_data["page_number"],
             ocr_text,
             now,
+            content_hash,
+            now,
         ),
     )
     conn.execute("DELETE FROM ocr_fts WHERE image_url = ?", (task_data["url"],))
@@ -224,6 +495,7 @@ def save_image_bytes(leaflet_name, page_number, image_bytes):
     return path
 
 def download_and_save_image(task_data):
+    import requests
     try:
         resp = requests.get(task_data["url"], headers=HEADERS, timeout=15)
         return save_image_bytes(task_data["leaflet_name"], task_data["page_number"], resp.content)
@@ -236,13 +508,12 @@ def preprocess_red_background(img):
     Idealna na czerwone tła, słaba na turkusowe.
     Wyciąga kanał Zielony.
     """
+    from PIL import Image
     if img.mode != 'RGB':
         img = img.convert('RGB')
     
-    r, g, b = img.split()
-    
-    # Używamy kanału G (Zielonego) jako bazy
-    img = g 
+    # Używamy kanału G (Zielonego) jako bazy — bez trzymania R i B w pamięci
+    img = img.getchannel('G')
     
     # Powiększenie dla małych liter
     img = img.resize((img.width * 2, img.height * 2), Image.Resampling.BILINEAR)
@@ -257,6 +528,7 @@ def preprocess_standard(img):
     Metoda Standardowa.
     Dobra na białe, żółte, turkusowe tła.
     """
+    from PIL import Image, ImageOps
     # Konwersja na szarość
     img = img.convert('L')
     
@@ -268,6 +540,7 @@ def preprocess_standard(img):
     return img
 
 def compress_image_for_discord(image_path):
+    from PIL import Image
     try:
         img = Image.open(image_path)
         if img.mode in ("RGBA", "P"): 
@@ -287,6 +560,7 @@ def compress_image_for_discord(image_path):
         return None
 
 def send_single_batch(files_dict, embeds_list, batch_num):
+    import requests
     try:
         payload = {"content": "", "embeds": embeds_list}
         response = requests.post(DISCORD_URL, data={"payload_json": json.dumps(payload)}, files=files_dict)
@@ -356,6 +630,8 @@ def sanitize_filename(name):
     return name[:100]
 
 def get_all_leaflet_uuids():
+    import requests
+    from bs4 import BeautifulSoup
     main_page_url = "https://www.biedronka.pl/pl/gazetki"
     print(f"🔎 KROK 1: Skanuję stronę główną...")
     try:
@@ -379,6 +655,7 @@ def get_all_leaflet_uuids():
     except: return []
 
 def get_leaflet_pages(leaflet_id):
+    import requests
     try:
         api_url = f"https://leaflet-api.prod.biedronka.cloud/api/leaflets/{leaflet_id}?ctx=web"
         response = requests.get(api_url, headers=HEADERS, timeout=10)
@@ -397,35 +674,121 @@ def get_leaflet_pages(leaflet_id):
         return name, pages_info
     except: return "Nieznana", []
 
-def process_page(task_data):
-    url = task_data['url']
-    
+def estimate_ocr_bytes(img):
+    return img.width * img.height * (len(img.getbands()) + OCR_PIXEL_OVERHEAD)
+
+def ocr_image_bytes(content, held=0):
+    """
+    OCR obu wariantów strony, z rezerwacją budżetu pamięci i zwalnianiem pośrednich obrazów.
+    `held` to bajty już zarezerwowane przez wołającego na surowe `content`.
+    """
+    import pytesseract
+    from PIL import Image
+
+    # Wczytujemy oryginał (Image.open czyta tylko nagłówek — rozmiar znamy przed dekodowaniem)
+    img_original = Image.open(BytesIO(content))
+    if MEMORY_BUDGET_BYTES:
+        per_worker = MEMORY_BUDGET_BYTES // MAX_WORKERS
+        estimate = estimate_ocr_bytes(img_original)
+        if estimate > per_worker:
+            # Dekodowanie w zmniejszonej skali (działa dla JPEG, dla innych formatów no-op)
+            scale = (per_worker / estimate) ** 0.5
+            img_original.draft(img_original.mode, (int(img_original.width * scale), int(img_original.height * scale)))
+    raw_bytes = 0 if held else len(content)
+    reserved = reserve_memory(estimate_ocr_bytes(img_original) + raw_bytes, held=held)
+
     try:
-        resp = requests.get(url, headers=HEADERS, timeout=15)
-        content = resp.content
-        
-        # Wczytujemy oryginał
-        img_original = Image.open(BytesIO(content))
-        
         # --- SKAN 1: STANDARDOWY (Dla turkusowych, białych itp.) ---
-        img_std = preprocess_standard(img_original.copy()) # Kopia, żeby nie zepsuć oryginału
+        # preprocess_* zwracają nowe obrazy, więc oryginału nie trzeba kopiować
+        img_std = preprocess_standard(img_original)
         text_std = pytesseract.image_to_string(img_std, lang='pol')
-        
+        del img_std
+
         # --- SKAN 2: SNAJPER (Dla czerwonych i trudnych kontrastów) ---
-        img_red = preprocess_red_background(img_original.copy())
+        img_red = preprocess_red_background(img_original)
+        img_original.close()
+        del img_original
         # Tutaj używamy konfiguracji psm 6 (blok tekstu), bo po progowaniu napisy są wyraźne
         text_red = pytesseract.image_to_string(img_red, lang='pol', config='--psm 6')
-        
-        # Łączymy wyniki z obu skanów
-        full_text = text_std + " " + text_red
+        del img_red
+    finally:
+        release_memory(reserved)
 
-        return full_text, content
+    # Łączymy wyniki z obu skanów
+    return text_std + " " + text_red
+
+def process_page(task_data, known_hashes=frozenset(), keyword=None, hit_hashes=frozenset()):
+    """
+    Pobiera stronę i robi OCR. Zwraca (tekst, bajty, hash treści, odzyskana).
+    Jeśli hash treści jest już w cache, OCR jest pomijany (tekst = None,
+    odzyskana = True) — tekst dociąga wątek główny z bazy, a bajty zostają
+    tylko dla hashy z `hit_hashes`.
+    Przy podanym `keyword` bajty obrazka są zwracane tylko dla trafień.
+    """
+    import requests
+    url = task_data['url']
+    
+    reserved = 0
+    try:
+        # Surowe bajty liczą się do budżetu już od pobrania. Rezerwujemy przed
+        # requests.get, żeby czekanie na budżet nie trzymało otwartego połączenia.
+        reserved = reserve_memory(DOWNLOAD_ESTIMATE_BYTES)
+        resp = requests.get(url, headers=HEADERS, timeout=15)
+        content = resp.content
+        del resp
+        if reserved and len(content) > reserved:
+            reserved += reserve_memory(len(content) - reserved, held=reserved)
+        elif reserved > len(content):
+            release_memory(reserved - len(content))
+            reserved = len(content)
+
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash in known_hashes:
+            return None, content if content_hash in hit_hashes else None, content_hash, True
+
+        full_text = ocr_image_bytes(content, held=reserved)
+        if keyword is not None and not keyword_in_text(full_text, keyword):
+            content = None
+
+        return full_text, content, content_hash, False
     except Exception as e:
         print(f"[OCR ERROR] {url}: {e}", file=sys.stderr)
-        return None, None
+        return None, None, None, False
+    finally:
+        release_memory(reserved)
+
+def iter_page_results(executor, tasks, *args):
+    """
+    Yield (task, process_page result) as pages finish. At most 2 * MAX_WORKERS
+    pages are submitted at once, and every finished future is dropped before its
+    result is handed out, so the image bytes of hits do not pile up in memory.
+    """
+    task_iter = iter(tasks)
+    pending = {}
+    while True:
+        while len(pending) < MAX_WORKERS * 2:
+            task = next(task_iter, None)
+            if task is None:
+                break
+            pending[executor.submit(process_page, task, *args)] = task
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        while done:
+            future = done.pop()
+            task = pending.pop(future)
+            result = future.result()
+            del future
+            yield task, result
+            del result
+
+_first_emit_at = None
 
 def emit(event_type, **kwargs):
     """Emit a JSON event to stdout for the GUI app."""
+    global _first_emit_at
+    if _first_emit_at is None:
+        _first_emit_at = time.perf_counter()
     msg = {"type": event_type, **kwargs}
     sys.stdout.write("JSON:" + json.dumps(msg, ensure_ascii=False) + "\n")
     sys.stdout.flush()
@@ -435,37 +798,34 @@ def gui_main(keyword, discord_enabled):
     """Main function for GUI mode - outputs JSON events instead of printing."""
     global KEYWORD_TO_FIND, DISCORD_URL
     KEYWORD_TO_FIND = keyword
-    if not discord_enabled:
-        DISCORD_URL = None
 
     # --- Startup diagnostics ---
     emit("status", message="Uruchamiam silnik wyszukiwania...")
+    load_env()
+    if not discord_enabled:
+        DISCORD_URL = None
+
+    tess_cmd = setup_tesseract()
     diag = {
         "platform": platform.system(),
         "python": sys.version,
         "cwd": os.getcwd(),
         "DATA_DIR": DATA_DIR,
         "SAVE_FOLDER": SAVE_FOLDER,
-        "tesseract_cmd": pytesseract.pytesseract.tesseract_cmd,
+        "tesseract_cmd": tess_cmd,
         "TESSDATA_PREFIX": os.environ.get("TESSDATA_PREFIX", "(not set)"),
     }
     print(f"[DIAG] {json.dumps(diag, ensure_ascii=False)}", file=sys.stderr)
 
     # Verify Tesseract is actually callable
-    tess_cmd = pytesseract.pytesseract.tesseract_cmd
     if not os.path.isfile(tess_cmd):
         emit("error", message=f"Tesseract nie znaleziony: {tess_cmd}")
         emit("done", found_count=0)
         return
 
     try:
-        import subprocess
-        result = subprocess.run(
-            [tess_cmd, "--version"],
-            capture_output=True, text=True, timeout=10
-        )
-        tess_ver = (result.stdout + result.stderr).strip().split('\n')[0]
-        print(f"[DIAG] Tesseract version: {tess_ver}", file=sys.stderr)
+        tess_ver, from_cache = probe_tesseract(tess_cmd)
+        print(f"[DIAG] Tesseract version: {tess_ver}{' (cache)' if from_cache else ''}", file=sys.stderr)
     except Exception as e:
         emit("error", message=f"Tesseract nie odpowiada: {e}")
         emit("done", found_count=0)
@@ -497,16 +857,22 @@ def gui_main(keyword, discord_enabled):
     emit("status", message=f"Łącznie {total_pages} stron. Ładuję indeks OCR...")
 
     conn = init_cache_db()
-    prune_cache_for_active_leaflets(conn, uuids)
     cached_urls = get_cached_urls(conn, all_tasks)
     cached_tasks = [t for t in all_tasks if t["url"] in cached_urls]
     uncached_tasks = [t for t in all_tasks if t["url"] not in cached_urls]
+    # Najpierw przypisujemy obsłużone strony do bieżących gazetek, potem retencja
+    touch_cached_pages(conn, cached_tasks)
+    evicted_pages = apply_cache_retention(conn, uuids)
+    known_hashes = get_known_content_hashes(conn)
+    hit_hashes = get_matching_content_hashes(conn, KEYWORD_TO_FIND)
 
     emit("status", message=f"Cache: {len(cached_tasks)} stron | Nowe: {len(uncached_tasks)} stron")
 
     all_found = []
     found_count = 0
     processed = 0
+    revived_count = 0
+    ocr_count = 0
 
     emit("progress", current=0, total=total_pages, leaflet="", page=0)
 
@@ -550,26 +916,37 @@ def gui_main(keyword, discord_enabled):
         writes_since_commit = 0
 
         with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_task = {executor.submit(process_page, task): task for task in uncached_tasks}
+            page_results = iter_page_results(executor, uncached_tasks, known_hashes, KEYWORD_TO_FIND, hit_hashes)
 
-            for future in as_completed(future_to_task):
-                task = future_to_task[future]
+            for task, (ocr_text, image_bytes, content_hash, revived) in page_results:
                 processed += 1
                 emit("progress", current=processed, total=total_pages,
                      leaflet=task['leaflet_name'][:30], page=task['page_number'])
 
-                ocr_text, image_bytes = future.result()
+                if revived:
+                    ocr_text = get_text_by_content_hash(conn, content_hash)
                 if not ocr_text:
                     continue
+                if revived:
+                    revived_count += 1
+                else:
+                    ocr_count += 1
 
-                save_page_to_cache(conn, task, ocr_text)
+                save_page_to_cache(conn, task, ocr_text, content_hash)
                 writes_since_commit += 1
                 if writes_since_commit >= 25:
                     conn.commit()
                     writes_since_commit = 0
 
-                if keyword_in_text(ocr_text, KEYWORD_TO_FIND) and image_bytes:
-                    saved_path = save_image_bytes(task['leaflet_name'], task['page_number'], image_bytes)
+                if keyword_in_text(ocr_text, KEYWORD_TO_FIND):
+                    if image_bytes:
+                        saved_path = save_image_bytes(task['leaflet_name'], task['page_number'], image_bytes)
+                        del image_bytes
+                    else:
+                        # Odzyskana strona spoza hit_hashes (FTS i keyword_in_text różnią się) — pobieramy ponownie
+                        saved_path = download_and_save_image(task)
+                    if not saved_path:
+                        continue
                     found_count += 1
                     all_found.append(saved_path)
                     abs_path = os.path.abspath(saved_path)
@@ -578,6 +955,10 @@ def gui_main(keyword, discord_enabled):
 
     conn.commit()
 
+    emit("stats", revived=revived_count, ocr=ocr_count, cached=len(cached_tasks), evicted=evicted_pages,
+         peak_rss_mb=get_peak_rss_mb())
+    emit("status", message=f"Odzyskane z cache: {revived_count} stron | Nowy OCR: {ocr_count} stron")
+
     # Discord
     if all_found and DISCORD_URL:
         emit("status", message="Wysyłam wyniki na Discorda...")
@@ -587,9 +968,50 @@ def gui_main(keyword, discord_enabled):
     emit("done", found_count=found_count)
 
 
+def startup_bench(bench_image=None):
+    """Report time-to-first-emit, the cost of the deferred startup stages and peak RSS."""
+    emit("status", message="Uruchamiam silnik wyszukiwania...")
+    first_emit_ms = (_first_emit_at - _START_TIME) * 1000
+
+    t0 = time.perf_counter()
+    load_env()
+    import requests, bs4, PIL.Image, pytesseract
+    imports_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    tess_cmd = setup_tesseract()
+    try:
+        tess_ver, from_cache = probe_tesseract(tess_cmd)
+    except Exception as e:
+        tess_ver, from_cache = f"(błąd: {e})", False
+    tesseract_ms = (time.perf_counter() - t0) * 1000
+
+    # Opcjonalnie: OCR lokalnego obrazka, żeby zmierzyć szczytowe zużycie pamięci
+    ocr_ms = None
+    if bench_image:
+        with open(bench_image, 'rb') as f:
+            content = f.read()
+        t0 = time.perf_counter()
+        ocr_image_bytes(content)
+        ocr_ms = round((time.perf_counter() - t0) * 1000, 2)
+
+    emit(
+        "bench",
+        first_emit_ms=round(first_emit_ms, 2),
+        imports_ms=round(imports_ms, 2),
+        tesseract_ms=round(tesseract_ms, 2),
+        tesseract_cached=from_cache,
+        tesseract_version=tess_ver,
+        ocr_ms=ocr_ms,
+        memory_budget_mb=round(MEMORY_BUDGET_BYTES / (1024 * 1024), 1),
+        peak_rss_mb=get_peak_rss_mb(),
+    )
+
+
 def main():
     global KEYWORD_TO_FIND
-    
+
+    load_env()
     print("="*60)
     KEYWORD_TO_FIND = input("Wpisz czego szukasz (np. mleko, masło): ").strip()
     while not KEYWORD_TO_FIND:
@@ -597,6 +1019,7 @@ def main():
         KEYWORD_TO_FIND = input("Wpisz czego szukasz (np. mleko, masło): ").strip()
 
     os.makedirs(SAVE_FOLDER, exist_ok=True)
+    setup_tesseract()
     print("="*60)
     print(f"   START SYSTEMU WYSZUKIWANIA PROMOCJI: '{KEYWORD_TO_FIND}'")
     print("="*60 + "\n")
@@ -616,12 +1039,15 @@ def main():
     print(f"\n🗂️ KROK 3: Ładuję indeks OCR ({OCR_CACHE_DB})")
 
     conn = init_cache_db()
-    removed_pages = prune_cache_for_active_leaflets(conn, uuids)
-    if removed_pages:
-        print(f"   🧹 Usunięto z cache nieaktualne strony: {removed_pages}")
     cached_urls = get_cached_urls(conn, all_tasks)
     cached_tasks = [task for task in all_tasks if task["url"] in cached_urls]
     uncached_tasks = [task for task in all_tasks if task["url"] not in cached_urls]
+    touch_cached_pages(conn, cached_tasks)
+    removed_pages = apply_cache_retention(conn, uuids)
+    if removed_pages:
+        print(f"   🧹 Usunięto z cache przeterminowane strony: {removed_pages}")
+    known_hashes = get_known_content_hashes(conn)
+    hit_hashes = get_matching_content_hashes(conn, KEYWORD_TO_FIND)
 
     print(f"   ✅ W cache: {len(cached_tasks)} stron")
     print(f"   🆕 Do OCR: {len(uncached_tasks)} stron")
@@ -641,29 +1067,42 @@ def main():
     print(f"\n🚀 KROK 5: OCR tylko dla nowych stron (hybrydowo)")
     processed = 0
     writes_since_commit = 0
+    revived_count = 0
+    ocr_count = 0
     
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_task = {executor.submit(process_page, task): task for task in uncached_tasks}
+        page_results = iter_page_results(executor, uncached_tasks, known_hashes, KEYWORD_TO_FIND, hit_hashes)
         
-        for future in as_completed(future_to_task):
-            task = future_to_task[future]
+        for task, (ocr_text, image_bytes, content_hash, revived) in page_results:
             processed += 1
             progress = (processed / len(uncached_tasks)) * 100 if uncached_tasks else 100
             status_msg = f"⏳ {processed}/{len(uncached_tasks)} ({progress:.0f}%) | {task['leaflet_name'][:20]}... S.{task['page_number']}"
             with print_lock: print(f"\r{status_msg:<80}", end="", flush=True)
             
-            ocr_text, image_bytes = future.result()
+            if revived:
+                ocr_text = get_text_by_content_hash(conn, content_hash)
             if not ocr_text:
                 continue
+            if revived:
+                revived_count += 1
+            else:
+                ocr_count += 1
 
-            save_page_to_cache(conn, task, ocr_text)
+            save_page_to_cache(conn, task, ocr_text, content_hash)
             writes_since_commit += 1
             if writes_since_commit >= 25:
                 conn.commit()
                 writes_since_commit = 0
 
-            if keyword_in_text(ocr_text, KEYWORD_TO_FIND) and image_bytes:
-                saved_path = save_image_bytes(task['leaflet_name'], task['page_number'], image_bytes)
+            if keyword_in_text(ocr_text, KEYWORD_TO_FIND):
+                if image_bytes:
+                    saved_path = save_image_bytes(task['leaflet_name'], task['page_number'], image_bytes)
+                    del image_bytes
+                else:
+                    # Odzyskana strona spoza hit_hashes (FTS i keyword_in_text różnią się) — pobieramy ponownie
+                    saved_path = download_and_save_image(task)
+                if not saved_path:
+                    continue
                 found_count += 1
                 all_found_images_paths.append(saved_path)
                 with print_lock:
@@ -674,6 +1113,7 @@ def main():
     conn.close()
 
     print(f"\n\n{'='*60}")
+    print(f"   Odzyskane z cache: {revived_count} | Nowy OCR: {ocr_count}")
     print(f"   Znaleziono: {found_count}")
     
     if all_found_images_paths:
@@ -685,12 +1125,26 @@ def main():
     print("="*60)
 
 if __name__ == "__main__":
-    if "--gui" in sys.argv:
+    if "--startup-bench" in sys.argv:
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--startup-bench", action="store_true")
+        parser.add_argument("--bench-image", type=str, default=None)
+        parser.add_argument("--memory-budget-mb", type=float, default=None)
+        args = parser.parse_args()
+        if args.memory_budget_mb is not None:
+            # Flaga ma pierwszeństwo przed .env (load_dotenv nie nadpisuje istniejących zmiennych)
+            os.environ["BIEDRONA_MEMORY_BUDGET_MB"] = str(args.memory_budget_mb)
+        startup_bench(args.bench_image)
+    elif "--gui" in sys.argv:
         parser = argparse.ArgumentParser()
         parser.add_argument("--gui", action="store_true")
         parser.add_argument("--keyword", required=True, type=str)
         parser.add_argument("--discord", action="store_true", default=False)
+        parser.add_argument("--memory-budget-mb", type=float, default=None)
         args = parser.parse_args()
+        if args.memory_budget_mb is not None:
+            # Flaga ma pierwszeństwo przed .env (load_dotenv nie nadpisuje istniejących zmiennych)
+            os.environ["BIEDRONA_MEMORY_BUDGET_MB"] = str(args.memory_budget_mb)
         try:
             gui_main(args.keyword, args.discord)
         except Exception as e: